@@ -19,17 +19,20 @@ Required fields: src_dir, dist_dir, output, module_roots.
 Optional fields: prepend, strip_requires, exclude_globs.
 """
 
+import glob
+import heapq
 import json
 import os
 import re
 import sys
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from collections import defaultdict
-import re as _re2
 
 REQUIRE_RE = re.compile(r"^\s*require\([\"\']([A-Za-z0-9_./-]+)[\"\']\)\s*$")
 COMMENT_RE = re.compile(r"^\s*--")
 BLANK_RE = re.compile(r"^\s*$")
+STRAY_REQUIRE_RE = re.compile(r"(?m)^(?!\s*--)\s*require\([\"']([A-Za-z0-9_./-]+)[\"']\)\s*(?:--.*)?\r?\n")
 
 # Resolve project root as the current working directory to allow generic usage
 PROJECT_ROOT = Path.cwd()
@@ -60,28 +63,11 @@ def read_project_info_from_pyproject(root: Path) -> tuple[str | None, str | None
     if not pyproject.exists():
         return None, None
     try:
-        lines = pyproject.read_text(encoding="utf-8").splitlines()
+        data = tomllib.loads(pyproject.read_text(encoding="utf-8"))
     except Exception:
         return None, None
-    in_project = False
-    name: str | None = None
-    version: str | None = None
-    for line in lines:
-        stripped = line.strip()
-        if stripped.startswith("[") and stripped.endswith("]"):
-            in_project = stripped.lower() == "[project]"
-            continue
-        if in_project and stripped.lower().startswith("name"):
-            m = re.match(r"name\s*=\s*\"([^\"]+)\"", stripped)
-            if m:
-                name = m.group(1)
-                continue
-        if in_project and stripped.lower().startswith("version"):
-            m = re.match(r"version\s*=\s*\"([^\"]+)\"", stripped)
-            if m:
-                version = m.group(1)
-                continue
-    return name, version
+    project = data.get("project", {})
+    return project.get("name"), project.get("version")
 
 
 def make_banner_comment(project_name: str | None, version: str | None) -> str:
@@ -95,14 +81,28 @@ def make_banner_comment(project_name: str | None, version: str | None) -> str:
 
 # Modules treated as project-local if they map to a file under src
 # Map 'foo.bar' => 'src/foo/bar.lua', 'foo/bar' => 'src/foo/bar.lua'
+# The index is built once per build so each require is a dict lookup, not a stat per root
+
+def walk_lua_files(root: Path) -> list[Path]:
+    # os.walk hands back plain strings; only build Paths for .lua files
+    out = [Path(dirpath, fn) for dirpath, _, fnames in os.walk(root) for fn in fnames if fn.endswith(".lua")]
+    out.sort()
+    return out
+
 
-def module_to_path(mod: str, module_roots: list[str]) -> Path | None:
-    rel = mod.replace(".", "/") + ".lua"
+def build_module_index(module_roots: list[str]) -> dict[str, Path]:
+    index: dict[str, Path] = {}
     for root in module_roots:
-        p = (PROJECT_ROOT / root / rel).resolve()
-        if p.exists():
-            return p
-    return None
+        # Not resolved: paths must compare equal to the unresolved ones from discover_sources
+        root_dir = PROJECT_ROOT / root
+        for p in walk_lua_files(root_dir):
+            # Earlier roots win, matching the lookup order of module_roots
+            index.setdefault(p.relative_to(root_dir).with_suffix("").as_posix(), p)
+    return index
+
+
+def module_to_path(mod: str, index: dict[str, Path]) -> Path | None:
+    return index.get(mod.replace(".", "/"))
 
 
 def is_comment(line: str) -> bool:
@@ -118,169 +118,211 @@ def is_require(line: str) -> str | None:
     return m.group(1) if m else None
 
 
-def _header_end_index(lines: list[str]) -> int:
-    i = 0
+def _next_line(text: str, pos: int) -> int:
+    # Offset of the line following the one that starts at pos
+    nl = text.find("\n", pos)
+    return len(text) if nl == -1 else nl + 1
+
+
+def _skip_lines(text: str, pos: int, pred) -> int:
+    # Advance past consecutive lines (starting at offset pos) for which pred holds
+    while pos < len(text):
+        end = _next_line(text, pos)
+        if not pred(text[pos:end]):
+            break
+        pos = end
+    return pos
+
+
+def _header_end_index(text: str) -> int:
+    # Works on offsets into the file text so callers never materialize a list of lines
     # Skip leading blanks
-    while i < len(lines) and is_blank(lines[i]):
-        i += 1
-    # If starts with block comment, skip until closing ']]'
-    if i < len(lines) and "--[[" in lines[i]:
-        while i < len(lines) and "]]" not in lines[i]:
-            i += 1
-        if i < len(lines):
-            i += 1  # move past the line containing ']]'
+    pos = _skip_lines(text, 0, is_blank)
+    # If starts with block comment, skip until the line containing the closing ']]'
+    if pos < len(text) and "--[[" in text[pos:_next_line(text, pos)]:
+        close = text.find("]]", pos)
+        pos = len(text) if close == -1 else _next_line(text, close)
     # After any block header, skip blanks and consecutive line comments (e.g., --- annotations)
-    while i < len(lines) and is_blank(lines[i]):
-        i += 1
-    while i < len(lines) and is_comment(lines[i]):
-        i += 1
-    while i < len(lines) and is_blank(lines[i]):
-        i += 1
-    return i
-
-
-def strip_initial_requires(content: str) -> str:
-    lines = content.splitlines(True)
-    i = _header_end_index(lines)
-    j = i
-    # Remove contiguous require lines (and any blank lines between them)
-    while j < len(lines) and (is_require(lines[j]) or is_blank(lines[j])):
-        j += 1
-    if j > i:
-        return "".join(lines[:i] + lines[j:])
-    return content
-
-
-def read_requires(path: Path) -> list[str]:
-    try:
-        text = path.read_text(encoding="utf-8")
-    except Exception:
-        return []
-    lines = text.splitlines()
+    pos = _skip_lines(text, pos, is_blank)
+    pos = _skip_lines(text, pos, is_comment)
+    pos = _skip_lines(text, pos, is_blank)
+    return pos
+
+
+def strip_stray_requires(chunk: str) -> str:
+    # Safety net: remove any stray non-comment top-level require(...) lines.
+    # Applied per file chunk so the bundle is never held in memory as a whole.
+    return STRAY_REQUIRE_RE.sub("", chunk)
+
+
+def emit_stripped(text: str, out, strip_requires: bool) -> None:
+    """Write one source file to out, trimmed to end in a single newline.
+
+    With strip_requires, the require block after the header is skipped and stray
+    require lines are removed. Only the spans that survive are sliced from the text.
+    """
+    end = len(text)
+    while end and text[end - 1].isspace():
+        end -= 1
+    if not strip_requires:
+        out.write(text[:end] + "\n")
+        return
+
+    i = _header_end_index(text)
+    # Skip contiguous require lines (and any blank lines between them)
+    j = _skip_lines(text, i, lambda line: is_require(line) or is_blank(line))
+    # Split the header before its trailing blank lines: the stray-require regex may match
+    # across them into the body, so they are filtered together with the body
+    k = min(i, end)
+    while k and text[k - 1].isspace():
+        k -= 1
+    if end <= j:
+        # Only whitespace follows the require block
+        chunks = [text[:k] + "\n"]
+    else:
+        h = text.find("\n", k) + 1 if k else 0
+        chunks = [text[:h], text[h:i] + text[j:end] + "\n"]
+    for chunk in chunks:
+        out.write(strip_stray_requires(chunk))
+
+
+def read_requires(text: str) -> list[str]:
     reqs: list[str] = []
-    idx = _header_end_index(lines)
+    pos = _header_end_index(text)
     # collect contiguous require lines (ignore blanks)
-    while idx < len(lines):
-        if is_blank(lines[idx]):
-            idx += 1
+    while pos < len(text):
+        end = _next_line(text, pos)
+        line = text[pos:end]
+        pos = end
+        if is_blank(line):
             continue
-        mod = is_require(lines[idx])
+        mod = is_require(line)
         if not mod:
             break
         reqs.append(mod)
-        idx += 1
     return reqs
 
 
 def discover_sources(src_dir: Path, exclude_globs: list[str] | None) -> list[Path]:
-    files = list(sorted(src_dir.rglob("*.lua")))
+    files = walk_lua_files(src_dir)
     if exclude_globs:
-        # simple glob-based exclusion
-        excluded: set[Path] = set()
-        for pattern in exclude_globs:
-            excluded.update(set(src_dir.glob(pattern.replace(src_dir.as_posix() + "/", ""))))
-        files = [p for p in files if p not in excluded]
+        # glob-based exclusion, matched against the path relative to src_dir in the same walk
+        excl_regexes = [
+            re.compile(glob.translate(pattern.replace(src_dir.as_posix() + "/", ""), recursive=True, include_hidden=True))
+            for pattern in exclude_globs
+        ]
+        kept: list[Path] = []
+        for p in files:
+            rel = p.relative_to(src_dir).as_posix()
+            if not any(r.match(rel) for r in excl_regexes):
+                kept.append(p)
+        files = kept
     return files
 
 
-def build_graph(files: list[Path], module_roots: list[str], header: Path | None) -> tuple[dict[Path, set[Path]], dict[Path, int]]:
+def read_sources(files: list[Path]) -> dict[Path, str]:
+    # Read every source exactly once; the graph scan and the writer share the text.
+    # File reads release the GIL, so fan them out over a small thread pool.
+    with ThreadPoolExecutor() as ex:
+        texts = ex.map(lambda f: f.read_text(encoding="utf-8"), files)
+        return dict(zip(files, texts))
+
+
+def build_graph(files: list[Path], sources: dict[Path, str], module_roots: list[str], header: Path | None) -> tuple[dict[Path, list[Path]], dict[Path, int]]:
     file_set = set(files)
-    edges: dict[Path, set[Path]] = {f: set() for f in files if (not header or f != header)}
+    index = build_module_index(module_roots)
+    # Adjacency lists: dependents are appended while walking files in sorted order,
+    # so each list is deterministic without a later sort
+    edges: dict[Path, list[Path]] = {f: [] for f in files if (not header or f != header)}
     indeg: dict[Path, int] = {f: 0 for f in files if (not header or f != header)}
 
     for f in files:
         if header and f == header:
             continue
-        reqs = read_requires(f)
+        reqs = read_requires(sources[f])
+        linked: set[Path] = set()
         for mod in reqs:
-            dep_path = module_to_path(mod, module_roots)
+            dep_path = module_to_path(mod, index)
             if dep_path and dep_path in file_set and (not header or dep_path != header):
                 # Direction: dependency -> dependent (so dependency comes first)
-                if f not in edges[dep_path]:
-                    edges[dep_path].add(f)
+                if dep_path not in linked:
+                    linked.add(dep_path)
+                    edges[dep_path].append(f)
                     indeg[f] += 1
             # Non-project requires are ignored for graph purposes
     return edges, indeg
 
 
-def topo_sort(edges: dict[Path, set[Path]], indeg: dict[Path, int]) -> list[Path]:
+def topo_sort(edges: dict[Path, list[Path]], indeg: dict[Path, int]) -> list[Path]:
     # Kahn's algorithm with stable, locality-preserving selection
-    # Order zero-indegree by (directory path, filename)
-    def key_fn(p: Path):
-        return (str(p.parent), str(p))
-
-    q = [p for p, d in indeg.items() if d == 0]
-    q.sort(key=key_fn)
+    # Order zero-indegree by (directory path, filename) using a min-heap.
+    # Keys are built once per node; POSIX form keeps the order identical on every platform.
+    keys = {p: (p.parent.as_posix(), p.as_posix()) for p in indeg}
+    key_fn = keys.__getitem__
+
+    # Keys are unique per path, so heap entries never fall through to comparing Paths
+    q = [(key_fn(p), p) for p, d in indeg.items() if d == 0]
+    heapq.heapify(q)
     out: list[Path] = []
     seen = set()
 
     while q:
-        # pop the first (preserves locality)
-        u = q.pop(0)
+        # pop the smallest key (preserves locality)
+        _, u = heapq.heappop(q)
         out.append(u)
         seen.add(u)
-        for v in sorted(edges[u], key=key_fn):
+        for v in edges[u]:
             indeg[v] -= 1
             if indeg[v] == 0:
-                q.append(v)
-                q.sort(key=key_fn)
+                heapq.heappush(q, (key_fn(v), v))
     # append any leftover nodes (in case of cycles). Maintain input order.
     for p in edges.keys():
-        if p not in out:
+        if p not in seen:
             out.append(p)
     return out
 
 
-def write_output(config: dict, order: list[Path]) -> None:
+def write_output(config: dict, order: list[Path], sources: dict[Path, str]) -> None:
     # Determine output path; allow absolute/relative path in "output"
     raw_output = config["output"]
     output_path = (PROJECT_ROOT / raw_output) if ("/" in raw_output or "\\" in raw_output) else ((PROJECT_ROOT / config["dist_dir"]) / raw_output)
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    parts: list[str] = []
+    strip_requires = ("strip_requires" in config) and bool(config["strip_requires"])
 
     proj_name, proj_version = read_project_info_from_pyproject(PROJECT_ROOT)
     banner_comment = make_banner_comment(proj_name, proj_version)
-    if banner_comment:
-        parts.append(banner_comment)
-    # Prepend files (if present), in order
-    prepend_list = config.get("prepend")
-    if prepend_list:
-        for p in prepend_list:
-            # Resolve relative to root first, else treat as relative to src_dir
-            abs_p = (PROJECT_ROOT / p)
-            if not abs_p.exists():
-                abs_p = (PROJECT_ROOT / config["src_dir"] / p)
-            if abs_p.exists():
-                parts.append(f"-- ==== BEGIN: {abs_p.relative_to(PROJECT_ROOT)} ====\n")
-                content = abs_p.read_text(encoding="utf-8")
-                parts.append(content)
-                parts.append(f"\n-- ==== END: {abs_p.relative_to(PROJECT_ROOT)} ====\n\n")
-
-    # Concat sources
-    for f in order:
-        rel = f.relative_to(PROJECT_ROOT)
-        parts.append(f"-- ==== BEGIN: {rel} ====\n")
-        content = f.read_text(encoding="utf-8")
-        if ("strip_requires" in config) and bool(config["strip_requires"]):
-            content = strip_initial_requires(content)
-        parts.append(content.rstrip() + "\n")
-        parts.append(f"-- ==== END: {rel} ====\n\n")
-
-    final_text = "".join(parts)
-    # Safety net: remove any stray non-comment top-level require(...) lines
-    if ("strip_requires" in config) and bool(config["strip_requires"]):
-        final_text = _re2.sub(
-            r"(?m)^(?!\s*--)\s*require\([\"']([A-Za-z0-9_./-]+)[\"']\)\s*(?:--.*)?\r?\n",
-            "",
-            final_text,
-        )
-    output_path.write_text(final_text, encoding="utf-8")
+    with output_path.open("w", encoding="utf-8") as out:
+        if banner_comment:
+            out.write(banner_comment)
+        # Prepend files (if present), in order
+        prepend_list = config.get("prepend")
+        if prepend_list:
+            for p in prepend_list:
+                # Resolve relative to root first, else treat as relative to src_dir
+                abs_p = (PROJECT_ROOT / p)
+                if not abs_p.exists():
+                    abs_p = (PROJECT_ROOT / config["src_dir"] / p)
+                if abs_p.exists():
+                    out.write(f"-- ==== BEGIN: {abs_p.relative_to(PROJECT_ROOT)} ====\n")
+                    content = sources.get(abs_p)
+                    if content is None:
+                        content = abs_p.read_text(encoding="utf-8")
+                    content += "\n"
+                    out.write(strip_stray_requires(content) if strip_requires else content)
+                    out.write(f"-- ==== END: {abs_p.relative_to(PROJECT_ROOT)} ====\n\n")
+
+        # Concat sources
+        for f in order:
+            rel = f.relative_to(PROJECT_ROOT)
+            out.write(f"-- ==== BEGIN: {rel} ====\n")
+            emit_stripped(sources[f], out, strip_requires)
+            out.write(f"-- ==== END: {rel} ====\n\n")
 
 
 def main(argv: list[str]) -> int:
     cfg = load_config(PROJECT_ROOT)
-    src_dir = (PROJECT_ROOT / cfg["src_dir"]).resolve()
+    src_dir = PROJECT_ROOT / cfg["src_dir"]
     files = discover_sources(src_dir, cfg.get("exclude_globs"))
     if not files:
         print(f"No source files found under {src_dir}", file=sys.stderr)
@@ -296,9 +338,10 @@ def main(argv: list[str]) -> int:
             header_path = hp
             break
 
-    edges, indeg = build_graph(files, cfg["module_roots"], header_path)
+    sources = read_sources(files)
+    edges, indeg = build_graph(files, sources, cfg["module_roots"], header_path)
     order = topo_sort(edges, indeg)
-    write_output(cfg, order)
+    write_output(cfg, order, sources)
     raw_output = cfg["output"]
     out = ((PROJECT_ROOT / raw_output) if ("/" in raw_output or "\\" in raw_output) else ((PROJECT_ROOT / cfg["dist_dir"]) / raw_output)).resolve()
     print(f"Built {out}")
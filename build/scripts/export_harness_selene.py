@@ -13,6 +13,8 @@ Notes:
 - We do not try to infer return types (Selene does not require them).
 - We also declare certain top-level tables as `new-fields` when useful in the
   future; for now we focus on functions only.
+- Parsed functions are cached per file in `.build-cache.json`, keyed by mtime
+  and size. Pass `--no-cache` to rescan everything.
 
 Usage:
   python build/scripts/export_harness_selene.py \
@@ -23,19 +25,17 @@ Usage:
 from __future__ import annotations
 
 import argparse
+import functools
+import itertools
+import json
 import os
 import re
-from dataclasses import dataclass
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Tuple
 
-try:
-    import yaml  # type: ignore
-except Exception as exc:  # noqa: BLE001
-    raise RuntimeError(
-        "PyYAML is required to export Selene YAML. Add pyyaml to dependencies."
-    ) from exc
-
 
 # Map simple Lua/Emmy types to Selene primitive names
 PRIMITIVE_TYPE_MAP: Dict[str, str] = {
@@ -52,6 +52,10 @@ PRIMITIVE_TYPE_MAP: Dict[str, str] = {
 }
 
 
+# Any of these characters marks a union/array/tuple type that is kept as a display string
+COMPLEX_TYPE_CHARS_RE = re.compile(r"[|,\[\]]")
+
+
 # Additional global tables/objects to export (available after harness init)
 # Use Selene's "property: new-fields" so consumers can access dynamic methods via colon calls.
 EXTRA_GLOBALS: Dict[str, Dict[str, Any]] = {
@@ -59,8 +63,19 @@ EXTRA_GLOBALS: Dict[str, Dict[str, Any]] = {
 }
 
 
-PARAM_RE = re.compile(r"^\s*---@param\s+(\w+)\s+([^\s]+)")
-FUNC_DEF_RE = re.compile(r"^\s*function\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(")
+# One pass over the whole file text. Each match is either a `---@param name type`
+# line (group "ptype") or a top-level `function Name(args)` line (groups "fname",
+# "fargs"). Whitespace classes exclude "\n" so a match never spans lines.
+EVENT_RE = re.compile(
+    r"(?m)^[^\S\n]*---@param[^\S\n]+\w+[^\S\n]+(?P<ptype>\S+)"
+    r"|^[^\S\n]*function[^\S\n]+(?P<fname>[A-Za-z_][A-Za-z0-9_]*)[^\S\n]*\((?P<fargs>[^)\n]*)\)"
+)
+
+
+# Sidecar cache of parsed functions, stored under the "selene_functions" section
+CACHE_FILE = Path(".build-cache.json")
+# Bump when parse_lua_public_functions changes so stale entries are not reused
+FUNCTIONS_CACHE_VERSION = 1
 
 
 @dataclass
@@ -70,115 +85,192 @@ class ParsedFunction:
     arg_types: List[str]
 
 
-def normalize_arg_type(type_string: str) -> Tuple[Dict[str, Any], bool]:
-    """Normalize a single Emmy type token into a Selene arg spec and optionality.
+@functools.lru_cache(maxsize=2048)
+def _classify_arg_type(raw: str) -> Tuple[str, str, bool]:
+    """Classify a stripped Emmy type token as (kind, value, is_optional).
 
-    - Recognizes optional marker suffix '?' (e.g., 'string?').
-    - Leaves union/complex displays intact, but strips optional '?' if present.
-    - Returns (arg_spec_dict, is_optional).
+    kind is "type" for Selene primitives (value is the primitive name) or
+    "display" for anything kept verbatim. The result is immutable so it can be
+    shared across the many annotations that repeat the same type token.
     """
-    raw = (type_string or "").strip()
     if not raw:
-        return ({"type": "any"}, False)
+        return ("type", "any", False)
 
     # Varargs passthrough
     if raw == "...":
-        return ({"type": "..."}, False)
+        return ("type", "...", False)
 
     # Detect and strip trailing optional marker '?'
-    is_optional = False
-    t = raw
-    if t.endswith("?"):
-        is_optional = True
-        t = t[:-1]
+    is_optional = raw.endswith("?")
+    t = raw[:-1] if is_optional else raw
 
     # If complex union/array/tuple, keep as display
-    if "|" in t or "," in t or "[" in t or "]" in t:
-        return ({"type": {"display": t}}, is_optional)
+    if COMPLEX_TYPE_CHARS_RE.search(t):
+        return ("display", t, is_optional)
 
     mapped = PRIMITIVE_TYPE_MAP.get(t.lower())
     if mapped is not None:
-        return ({"type": mapped}, is_optional)
+        return ("type", mapped, is_optional)
 
     # Fallback to display
-    return ({"type": {"display": t}}, is_optional)
+    return ("display", t, is_optional)
+
+
+def normalize_arg_type(type_string: str) -> Tuple[Dict[str, Any], bool]:
+    """Normalize a single Emmy type token into a Selene arg spec and optionality.
+
+    - Recognizes optional marker suffix '?' (e.g., 'string?').
+    - Leaves union/complex displays intact, but strips optional '?' if present.
+    - Returns (arg_spec_dict, is_optional).
+
+    Classification is memoized; the returned dict is always fresh, since shared
+    objects would be emitted as YAML anchors/aliases.
+    """
+    kind, value, is_optional = _classify_arg_type((type_string or "").strip())
+    if kind == "display":
+        return ({"type": {"display": value}}, is_optional)
+    return ({"type": value}, is_optional)
 
 
 def build_function_args(param_type_list: Iterable[str]) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    for t in param_type_list:
-        spec, is_optional = normalize_arg_type(t)
-        # Copy spec and add required:false when optional
-        arg_entry: Dict[str, Any] = {"type": spec["type"]}  # type: ignore[index]
-        if is_optional:
-            arg_entry["required"] = False
-        out.append(arg_entry)
-    return out
+    # Copy spec and add required:false when optional
+    return [
+        {"type": spec["type"], "required": False} if is_optional else {"type": spec["type"]}
+        for spec, is_optional in map(normalize_arg_type, param_type_list)
+    ]
+
+
+def _has_code_line(text: str, start: int, end: int) -> bool:
+    """Return True if any full line in text[start:end] is not a Lua comment.
+
+    Blank lines count as code here, matching the reset rule of the scanner.
+    """
+    return any(not line.lstrip().startswith("--") for line in text[start:end].split("\n")[:-1])
 
 
 def parse_lua_public_functions(lua_path: Path) -> List[ParsedFunction]:
     """Parse a Lua file for global functions and associated @param types.
 
     Strategy:
-      - Walk lines, collecting contiguous `---@param` lines and mapping to an
-        ordered list of types by their appearance order.
-      - When we hit a top-level `function Name(` definition, bind the previously
-        collected param type list to this function and reset accumulator.
+      - Scan the text for `---@param` and top-level `function Name(` lines in a
+        single regex pass, collecting param types in their appearance order.
+      - When we hit a function definition, bind the previously collected param
+        type list to this function and reset accumulator.
+      - Pending params are dropped if any non-comment line sits between them and
+        the next event, so stale annotations never attach to a later function.
     """
     try:
         text = lua_path.read_text(encoding="utf-8")
     except Exception:
         return []
+    # Only function definitions produce results; skip files that cannot contain one
+    if "function" not in text:
+        return []
 
-    lines = text.splitlines()
     pending_param_types: List[str] = []
     results: List[ParsedFunction] = []
+    # Offset of the first line after the previous event
+    scan_from = 0
+
+    for m in EVENT_RE.finditer(text):
+        # Reset pending when a non-annotation line was encountered between blocks
+        if pending_param_types and _has_code_line(text, scan_from, m.start()):
+            # a new chunk of code started; clear stale params to avoid mismatches
+            pending_param_types = []
+        nl = text.find("\n", m.end())
+        scan_from = len(text) if nl == -1 else nl + 1
 
-    for line in lines:
-        m_param = PARAM_RE.match(line)
-        if m_param:
+        type_str = m.group("ptype")
+        if type_str is not None:
             # We only need the type order, name is not required for Selene
-            type_str = m_param.group(2)
             pending_param_types.append(type_str)
             continue
 
-        m_func = re.match(r"^\s*function\s+([A-Za-z_][A-Za-z0-9_]*)\s*\(([^)]*)\)", line)
-        if m_func:
-            fname = m_func.group(1)
-            arglist = m_func.group(2).strip()
-            argcount = 0
-            if arglist:
-                # count args; ignore trailing comments/spaces
-                # handle varargs ... as single arg
-                items = [a.strip() for a in arglist.split(",") if a.strip()]
-                argcount = len(items)
-            # Use pending param types in order, fill remainder with any
-            types_for_args = list(pending_param_types[:argcount])
-            while len(types_for_args) < argcount:
-                types_for_args.append("any")
-            results.append(ParsedFunction(name=fname, arg_types=types_for_args))
-            pending_param_types = []
-            continue
-
-        # Reset pending when non-annotation non-blank encountered between blocks
-        if pending_param_types and not line.strip().startswith("---") and not line.strip().startswith("--"):
-            # a new chunk of code started; clear stale params to avoid mismatches
-            pending_param_types = []
+        fname = m.group("fname")
+        arglist = m.group("fargs").strip()
+        argcount = 0
+        if arglist:
+            # count args; ignore trailing comments/spaces
+            # handle varargs ... as single arg
+            items = [a.strip() for a in arglist.split(",") if a.strip()]
+            argcount = len(items)
+        # Use pending param types in order, fill remainder with any
+        types_for_args = list(pending_param_types[:argcount])
+        while len(types_for_args) < argcount:
+            types_for_args.append("any")
+        results.append(ParsedFunction(name=fname, arg_types=types_for_args))
+        pending_param_types = []
 
     return results
 
 
-def collect_public_functions(src_dir: Path) -> List[ParsedFunction]:
-    funcs: List[ParsedFunction] = []
-    for p in sorted(src_dir.rglob("*.lua")):
-        # Skip internal or header files by convention
-        name = p.name.lower()
-        if name.startswith("_"):
-            continue
-        funcs.extend(parse_lua_public_functions(p))
+def load_cache(path: Path) -> Dict[str, Any]:
+    try:
+        cache = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_cache(path: Path, cache: Dict[str, Any]) -> None:
+    try:
+        path.write_text(json.dumps(cache), encoding="utf-8")
+    except OSError as exc:
+        print(f"Warning: could not write {path}: {exc}", file=sys.stderr)
+
+
+def _cached_functions(entry: Any, st: os.stat_result) -> List[ParsedFunction] | None:
+    """Return the functions stored in a cache entry, or None if it is stale or malformed."""
+    try:
+        if entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+            return None
+        funcs = [ParsedFunction(**fn) for fn in entry["functions"]]
+    except Exception:
+        # Hand-edited or partially written entry: treat as a miss and rescan the file
+        return None
+    if not all(isinstance(f.name, str) and isinstance(f.arg_types, list) for f in funcs):
+        return None
     return funcs
 
 
+def collect_public_functions(
+    src_dir: Path, cache: Dict[str, Any] | None = None
+) -> List[ParsedFunction]:
+    """Collect public functions from every non-internal Lua file under src_dir.
+
+    When ``cache`` is given it maps str(path) -> {"mtime_ns", "size", "functions"};
+    files whose stat still matches are not re-read, and the mapping is rewritten in
+    place to hold exactly the current files.
+    """
+    # Skip internal or header files by convention
+    lua_files = [p for p in sorted(src_dir.rglob("*.lua")) if not p.name.lower().startswith("_")]
+    previous = dict(cache) if cache is not None else {}
+    stats = {p: p.stat() for p in lua_files}
+    parsed: Dict[Path, List[ParsedFunction]] = {}
+    stale: List[Path] = []
+    for p in lua_files:
+        cached = _cached_functions(previous.get(str(p)), stats[p])
+        if cached is not None:
+            parsed[p] = cached
+        else:
+            stale.append(p)
+
+    # Files are independent; map() keeps results paired with their inputs
+    with ThreadPoolExecutor() as ex:
+        parsed.update(zip(stale, ex.map(parse_lua_public_functions, stale)))
+
+    if cache is not None:
+        cache.clear()
+        for p in lua_files:
+            cache[str(p)] = {
+                "mtime_ns": stats[p].st_mtime_ns,
+                "size": stats[p].st_size,
+                "functions": [asdict(fn) for fn in parsed[p]],
+            }
+    # Concatenate in sorted file order so output stays deterministic
+    return list(itertools.chain.from_iterable(parsed[p] for p in lua_files))
+
+
 def export_selene_yaml(funcs: List[ParsedFunction]) -> Dict[str, Any]:
     globals_out: Dict[str, Any] = {}
     for f in funcs:
@@ -195,25 +287,62 @@ def export_selene_yaml(funcs: List[ParsedFunction]) -> Dict[str, Any]:
     return doc
 
 
+def dump_selene_yaml(data: Dict[str, Any]) -> str:
+    # Imported here so `--help` and the parsing helpers do not pay for PyYAML
+    try:
+        import yaml  # type: ignore
+    except Exception as exc:  # noqa: BLE001
+        raise RuntimeError(
+            "PyYAML is required to export Selene YAML. Add pyyaml to dependencies."
+        ) from exc
+
+    # Prefer the libyaml-backed dumper; PyYAML builds without libyaml only ship the pure-Python one
+    try:
+        from yaml import CSafeDumper as SafeDumper  # type: ignore
+    except ImportError:
+        from yaml import SafeDumper  # type: ignore
+
+    return yaml.dump(data, Dumper=SafeDumper, sort_keys=False, allow_unicode=True)
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Export Harness API to Selene YAML")
     parser.add_argument("--src", default="src", help="Source directory to scan")
     parser.add_argument(
         "--output", "-o", default="dist/harness-selene.yml", help="Output YAML file"
     )
+    parser.add_argument(
+        "--no-cache", action="store_true", help=f"Ignore and do not update {CACHE_FILE}"
+    )
     args = parser.parse_args()
 
     src_dir = Path(args.src).resolve()
     if not src_dir.exists() or not src_dir.is_dir():
         raise SystemExit(f"Source directory not found: {src_dir}")
 
-    funcs = collect_public_functions(src_dir)
-    data = export_selene_yaml(funcs)
+    if args.no_cache:
+        funcs = collect_public_functions(src_dir)
+    else:
+        cache = load_cache(CACHE_FILE)
+        section = cache.get("selene_functions")
+        if not (
+            isinstance(section, dict)
+            and section.get("version") == FUNCTIONS_CACHE_VERSION
+            and isinstance(section.get("files"), dict)
+        ):
+            section = {"version": FUNCTIONS_CACHE_VERSION, "files": {}}
+        previous = dict(section["files"])
+        funcs = collect_public_functions(src_dir, section["files"])
+        # Only rewrite the sidecar when an entry was added, changed or dropped
+        if cache.get("selene_functions") is not section or section["files"] != previous:
+            cache["selene_functions"] = section
+            save_cache(CACHE_FILE, cache)
+    # Serialize before touching the output so a missing PyYAML leaves it intact
+    text = dump_selene_yaml(export_selene_yaml(funcs))
 
     out_path = Path(args.output)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, sort_keys=False, allow_unicode=True)
+    out_path.write_text(text, encoding="utf-8")
     print(f"Selene YAML exported to {out_path}")
     return 0
 
@@ -3,13 +3,15 @@
 Tiny helper to stamp HARNESS_VERSION inside dist/harness.lua after the bundle is built.
 
 - Reads [project].version from pyproject.toml
-- Replaces first HARNESS_VERSION = "..." if present
+- Replaces first HARNESS_VERSION = "..." if present (the file is not rewritten
+  when it already carries the current version)
 - Otherwise inserts a HARNESS_VERSION line near the top (after the first line
   if it starts with a log.info banner, else at the very beginning)
 """
 from __future__ import annotations
 
 import re
+import tomllib
 from pathlib import Path
 import sys
 
@@ -22,18 +24,14 @@ def read_version(pyproject: Path) -> str:
     if not pyproject.exists():
         print("pyproject.toml not found", file=sys.stderr)
         sys.exit(2)
-    version: str | None = None
-    in_project = False
-    for line in pyproject.read_text(encoding="utf-8").splitlines():
-        s = line.strip()
-        if s.startswith("[") and s.endswith("]"):
-            in_project = (s.lower() == "[project]")
-            continue
-        if in_project and s.lower().startswith("version"):
-            m = re.match(r"version\s*=\s*\"([^\"]+)\"", s)
-            if m:
-                version = m.group(1)
-                break
+    try:
+        # tomllib decodes the binary stream itself; no intermediate str copy of the file
+        with pyproject.open("rb") as f:
+            data = tomllib.load(f)
+    except tomllib.TOMLDecodeError as exc:
+        print(f"Failed to parse {pyproject}: {exc}", file=sys.stderr)
+        sys.exit(2)
+    version = data.get("project", {}).get("version")
     if not version:
         print("version not found in [project] of pyproject.toml", file=sys.stderr)
         sys.exit(2)
@@ -51,10 +49,13 @@ def stamp_version(dist_file: Path, version: str) -> None:
     pattern = re.compile(r'^\s*HARNESS_VERSION\s*=\s*".*?"\s*$', flags=re.MULTILINE)
     if pattern.search(text):
         new_text = pattern.sub(f'HARNESS_VERSION = "{version}"', text, count=1)
-        if new_text != text:
-            dist_file.write_text(new_text, encoding="utf-8")
-            print(f"Updated HARNESS_VERSION to {version}")
+        if new_text == text:
+            # Leave the file (and its mtime) alone so downstream caches stay valid
+            print(f"HARNESS_VERSION already {version}")
             return
+        dist_file.write_text(new_text, encoding="utf-8")
+        print(f"Updated HARNESS_VERSION to {version}")
+        return
 
     # Case 2: Inject near the top
     lines = text.splitlines(True)
@@ -1,5 +1,4 @@
-import os
-import sys
+from pathlib import Path
 
 # -- Project information -----------------------------------------------------
 project = "Harness"
@@ -21,7 +20,7 @@ html_static_path = ["_static"]
 
 # -- sphinx-lua configuration -----------------------------------------------
 # Point to the Lua source directory so sphinx-lua can discover files
-lua_source_path = [os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))]
+lua_source_path = [str(Path(__file__).resolve().parent.parent / "src")]
 
 # Treat '---' EmmyLua docblocks as documentation, and respect private prefix
 lua_source_encoding = "utf8"